@@ -35,7 +35,7 @@ ADMIN_API_TOKEN="${ADMIN_API_TOKEN:-}"
 PORT="${PORT:-8000}"
 HOST="${HOST:-0.0.0.0}"
 
-REQS="fastapi uvicorn[standard] python-multipart pydantic"
+REQS="fastapi uvicorn[standard] python-multipart pydantic>=2 orjson"
 
 
 BOOTSTRAP_PATH="$APP_DIR/bootstrap.sh"
@@ -87,26 +87,12 @@ info "Installing Python dependencies into venv"
 sudo -u "$ORCH_USER" "$VENV_DIR/bin/pip" install --upgrade pip
 sudo -u "$ORCH_USER" "$VENV_DIR/bin/pip" install $REQS
 
-# 5) create storage dir and init JSON files
+# 5) create storage dir (orch.db is created by the app on first start)
 info "Preparing storage dir $STORAGE_DIR"
 mkdir -p "$STORAGE_DIR/envs"
 chown -R "$ORCH_USER:$ORCH_USER" "$STORAGE_DIR"
 chmod 750 "$STORAGE_DIR"
 
-AGENTS_FILE="$STORAGE_DIR/agents.json"
-JOBS_FILE="$STORAGE_DIR/jobs.json"
-
-if [ ! -f "$AGENTS_FILE" ]; then
-  echo "{}" > "$AGENTS_FILE"
-  chown "$ORCH_USER:$ORCH_USER" "$AGENTS_FILE"
-  chmod 600 "$AGENTS_FILE"
-fi
-if [ ! -f "$JOBS_FILE" ]; then
-  echo "{}" > "$JOBS_FILE"
-  chown "$ORCH_USER:$ORCH_USER" "$JOBS_FILE"
-  chmod 600 "$JOBS_FILE"
-fi
-
 # 6) create systemd service unit
 SERVICE_PATH="/etc/systemd/system/$SERVICE_NAME"
 info "Writing systemd unit to $SERVICE_PATH"
@@ -179,4 +165,4 @@ fi
 
 info "Bootstrap finished. If the service failed, inspect logs with 'sudo journalctl -u $SERVICE_NAME -f'."
 info "Application path: $APP_DIR/orchestrator.py"
-info "Storage path: $STORAGE_DIR (agents.json, jobs.json, envs/)"
+info "Storage path: $STORAGE_DIR (orch.db, envs/)"
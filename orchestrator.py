@@ -3,22 +3,56 @@
 orchestrator_minimal.py avec streaming des logs en temps réel
 """
 import uuid
+import hashlib
+import hmac
+import re
 import os
 import time
-import subprocess
+import asyncio
+import codecs
+import signal
 import tempfile
-from typing import Optional, Dict, Any
+import mmap
+from contextlib import asynccontextmanager, suppress
+import sqlite3
+from typing import Optional, Dict, Any, List, Tuple
 from fastapi import FastAPI, HTTPException, Header, File, UploadFile, Form, Body
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import json
+import orjson
 from pydantic import BaseModel, Field
-from fastapi.responses import JSONResponse
-from urllib.parse import urlparse
+from fastapi.responses import FileResponse, JSONResponse
 # --- utils file storage (atomic read/write) ---
 import threading
+import queue
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
 
 _fs_lock = threading.Lock()
 
+# orjson ne gère que les entiers 64 bits: au-delà, loads les convertit en float
+# (perte silencieuse) et dumps lève. Un entier hors plage a au moins 19 chiffres;
+# dans ce cas (rare) on passe par la lib standard, exacte.
+_LONG_DIGITS_RE = re.compile(r"\d{19}")
+_LONG_DIGITS_RE_B = re.compile(rb"\d{19}")
+
+def json_loads(data):
+    """Parse du JSON (str ou bytes-like) sans perte sur les grands entiers."""
+    long_digits = _LONG_DIGITS_RE if isinstance(data, str) else _LONG_DIGITS_RE_B
+    if long_digits.search(data):
+        return json.loads(data if isinstance(data, (str, bytes, bytearray)) else bytes(data))
+    return orjson.loads(data)
+
+def json_dumps(obj) -> bytes:
+    """Sérialise en JSON compact; repli sur la lib standard pour les grands entiers."""
+    try:
+        return orjson.dumps(obj)
+    except orjson.JSONEncodeError:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
 def read_json(path: str):
     """
     Lit un fichier JSON et retourne le dict.
@@ -29,8 +63,8 @@ def read_json(path: str):
         try:
             if not os.path.exists(path):
                 return {}
-            with open(path, "r") as fh:
-                return json.load(fh)
+            with open(path, "rb") as fh:
+                return json_loads(fh.read())
         except Exception as e:
             # propagate a clear error to server logs
             raise RuntimeError(f"failed to read json {path}: {e}")
@@ -38,20 +72,36 @@ def read_json(path: str):
 def write_json(path: str, data):
     """
     Écrit atomiquement un objet JSON dans `path`.
+    Le dossier parent doit exister (créé au démarrage).
     """
-    dirn = os.path.dirname(path) or "."
-    os.makedirs(dirn, exist_ok=True)
     tmp = path + ".tmp"
     with _fs_lock:
-        with open(tmp, "w") as fh:
-            json.dump(data, fh, indent=2)
+        with open(tmp, "wb") as fh:
+            fh.write(json_dumps(data))
         os.replace(tmp, path)
         try:
             os.chmod(path, 0o600)
         except Exception:
             pass
 
-app = FastAPI(title="Orchestrator Deployment", version="1.2")
+class OrjsonResponse(JSONResponse):
+    """Réponse JSON sérialisée par orjson (classe par défaut de l'app)."""
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # flush périodique des last_seen (cf. touch_last_seen), même sans trafic
+    flusher = asyncio.create_task(_last_seen_flusher())
+    try:
+        yield
+    finally:
+        flusher.cancel()
+        pending = flush_last_seen()
+        if pending:
+            await asyncio.wrap_future(pending)
+
+app = FastAPI(title="Orchestrator Deployment", version="1.2", lifespan=lifespan, default_response_class=OrjsonResponse)
 
 # Config via env
 DEPLOY_CERT_SCRIPT = os.environ.get("DEPLOY_CERT_SCRIPT", "/opt/vps-deployment/deploy_app_with_certs.sh")
@@ -60,6 +110,9 @@ ADMIN_API_TOKEN    = os.environ.get("ADMIN_API_TOKEN")  # if set, API requires h
 DEFAULT_TIMEOUT    = int(os.environ.get("DEFAULT_TIMEOUT", "1800"))  # seconds
 APPS_BASE          = os.environ.get("APPS_BASE", "/opt/vps-deployment/apps")
 
+# directories are created once here, not on every write
+os.makedirs(APPS_BASE, exist_ok=True)
+
 class DeployReq(BaseModel):
     repo_url: str
     domain: Optional[str] = None
@@ -69,19 +122,17 @@ class DeployReq(BaseModel):
 
 def require_admin(token_header: Optional[str]):
     if ADMIN_API_TOKEN:
-        if not token_header or token_header != ADMIN_API_TOKEN:
+        if not token_header or not hmac.compare_digest(token_header.encode("utf-8"), ADMIN_API_TOKEN.encode("utf-8")):
             raise HTTPException(status_code=403, detail="invalid admin token")
 
+_APP_NAME_RE = re.compile(r"(?!\.)(?!.*\.\.)[A-Za-z0-9_.-]{1,100}")
+
 def sanitize_app_name(repo_url: str) -> str:
-    try:
-        parsed = urlparse(repo_url)
-        path = parsed.path or repo_url
-    except Exception:
-        path = repo_url
-    base = os.path.basename(path)
+    path = repo_url.partition("#")[0].partition("?")[0]
+    base = path.rpartition("/")[2]
     if base.endswith(".git"):
         base = base[:-4]
-    if not base or "/" in base or "\\" in base or ".." in base:
+    if not _APP_NAME_RE.fullmatch(base):
         raise HTTPException(status_code=400, detail=f"cannot derive safe app name from repo_url: {repo_url}")
     return base
 
@@ -91,42 +142,125 @@ def dict_to_env_bytes(env: Dict[str, Any]) -> bytes:
         if not isinstance(k, str) or k.strip() == "":
             continue
         s = "" if v is None else str(v)
-        safe = s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
-        lines.append(f'{k}="{safe}"')
+        # la plupart des valeurs n'ont rien à échapper: on évite les trois copies
+        if "\\" in s or '"' in s or "\n" in s:
+            s = s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        lines.append(f'{k}="{s}"')
     return ("\n".join(lines) + "\n").encode("utf-8")
 
 def atomic_write(path: str, data: bytes, mode: int = 0o600):
-    dirn = os.path.dirname(path)
-    os.makedirs(dirn, exist_ok=True)
-    fd, tmp = tempfile.mkstemp(dir=dirn)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
     try:
         with os.fdopen(fd, "wb") as fh:
             fh.write(data)
         os.replace(tmp, path)
         os.chmod(path, mode)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+async def spool_upload(upload: UploadFile, dirn: Optional[str] = None) -> str:
+    """
+    Copie un upload par blocs dans un fichier temporaire (dans `dirn`)
+    et retourne son chemin, sans charger l'upload entier en mémoire.
+    """
+    # mkstemp crée le fichier en 0600; toutes les opérations disque passent par le threadpool
+    fd, tmp = await run_in_threadpool(tempfile.mkstemp, dir=dirn)
+    try:
+        fh = os.fdopen(fd, "wb")
+        try:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                await run_in_threadpool(fh.write, chunk)
+        finally:
+            await run_in_threadpool(fh.close)
+    except BaseException:
+        await run_in_threadpool(_remove_quietly, tmp)
+        raise
+    return tmp
+
+def _remove_quietly(path: str):
+    with suppress(FileNotFoundError):
+        os.remove(path)
+
+def parse_spooled_json(tmp: str):
+    """Parse un upload spoolé puis le supprime (sync, pour run_in_threadpool)."""
+    try:
+        return load_json_file(tmp)
     finally:
-        if os.path.exists(tmp):
-            try:
-                os.remove(tmp)
-            except Exception:
-                pass
+        _remove_quietly(tmp)
 
-def stream_script(script_path: str, args: list, timeout: int):
+def store_spooled_json(tmp: str, out_path: str):
+    """
+    Valide un upload spoolé puis le renomme en `out_path` (sync, pour
+    run_in_threadpool). En cas d'échec le fichier temporaire est supprimé.
+    """
+    try:
+        load_json_file(tmp)
+        os.replace(tmp, out_path)
+    except BaseException:
+        _remove_quietly(tmp)
+        raise
+
+def load_json_file(path: str):
+    """
+    Parse un fichier JSON via mmap: orjson lit directement la zone mappée,
+    sans copie du contenu dans le heap Python (sauf repli grands entiers).
+    """
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            raise ValueError(f"empty json file {path}")
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return json_loads(view)
+
+STREAM_CHUNK_SIZE = 64 * 1024
+KILL_GRACE_SECONDS = 5
+
+def _kill_process_group(process):
+    # le script tourne dans sa propre session: on tue aussi ses descendants
+    with suppress(ProcessLookupError):
+        os.killpg(process.pid, signal.SIGKILL)
+
+async def stream_script(script_path: str, args: list, timeout: int):
     """Exécute un script et yield ses logs en direct"""
     if not os.path.isfile(script_path) or not os.access(script_path, os.X_OK):
         yield f"ERROR: script not found or not executable: {script_path}\n"
         return
 
-    cmd = [script_path] + args
+    process = await asyncio.create_subprocess_exec(
+        script_path, *args,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True,
+    )
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    # blocs de taille fixe (pas de limite de longueur de ligne), décodés sans
+    # couper un caractère UTF-8 entre deux blocs
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
     try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        for line in process.stdout:
-            yield line  # stream vers client HTTP
-        process.wait(timeout=timeout)
+        while True:
+            chunk = await asyncio.wait_for(process.stdout.read(STREAM_CHUNK_SIZE), deadline - loop.time())
+            if not chunk:
+                break
+            text = decoder.decode(chunk)
+            if text:
+                yield text  # stream vers client HTTP
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+        await asyncio.wait_for(process.wait(), deadline - loop.time())
         yield f"\n--- Process exited with code {process.returncode} ---\n"
-    except subprocess.TimeoutExpired:
-        process.kill()
+    except asyncio.TimeoutError:
+        _kill_process_group(process)
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(process.wait(), KILL_GRACE_SECONDS)
         yield f"\n--- ERROR: script timeout after {timeout} seconds ---\n"
+    finally:
+        # client déconnecté ou exception: ne pas laisser tourner le script sans lecteur
+        if process.returncode is None:
+            _kill_process_group(process)
 
 @app.get("/")
 def root():
@@ -144,13 +278,13 @@ async def deploy(
 
     env_dict = {}
     if env_file:
-        contents = await env_file.read()
-        env_dict = json.loads(contents.decode("utf-8"))
+        tmp = await spool_upload(env_file)
+        env_dict = await run_in_threadpool(parse_spooled_json, tmp)
 
     if env_dict:
         env_bytes = dict_to_env_bytes(env_dict)
         env_path = os.path.join(APPS_BASE, ".env")
-        atomic_write(env_path, env_bytes, mode=0o600)
+        await run_in_threadpool(atomic_write, env_path, env_bytes, mode=0o600)
 
     script = DEPLOY_SPA_SCRIPT if is_spa else DEPLOY_CERT_SCRIPT
     args = [repo_url]
@@ -163,30 +297,223 @@ async def deploy(
 # ---- Cas B endpoints (agents) ----
 # --- storage paths and init for Case B (agents/jobs/envs) ---
 ORCH_B_STORAGE = os.environ.get("ORCH_B_STORAGE", "/var/lib/orch_b")
-AGENTS_FILE = os.path.join(ORCH_B_STORAGE, "agents.json")
-JOBS_FILE   = os.path.join(ORCH_B_STORAGE, "jobs.json")
+DB_FILE     = os.path.join(ORCH_B_STORAGE, "orch.db")
+AGENTS_FILE = os.path.join(ORCH_B_STORAGE, "agents.json")  # ancien stockage, importé au démarrage
+JOBS_FILE   = os.path.join(ORCH_B_STORAGE, "jobs.json")    # ancien stockage, importé au démarrage
 ENVS_DIR    = os.path.join(ORCH_B_STORAGE, "envs")
 
 # Ensure storage directories/files exist and are writable by the process user
 os.makedirs(ENVS_DIR, exist_ok=True)
 
-# create empty JSON files if missing
-if not os.path.exists(AGENTS_FILE):
+_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS agents (
+    id    TEXT PRIMARY KEY,
+    token TEXT NOT NULL UNIQUE,
+    data  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id        TEXT PRIMARY KEY,
+    agent_id  TEXT NOT NULL,
+    status    TEXT NOT NULL,
+    env_token TEXT,
+    data      TEXT NOT NULL
+);
+-- index partiel: seuls les jobs pending y figurent, il reste petit quel que
+-- soit l'historique (poll_jobs, download_env)
+CREATE INDEX IF NOT EXISTS jobs_pending_by_agent ON jobs (agent_id) WHERE status = 'pending';
+"""
+
+def _to_db(obj) -> str:
+    return json_dumps(obj).decode("utf-8")
+
+def _import_legacy_json(conn: sqlite3.Connection):
+    """
+    Importe agents.json / jobs.json (stockage avant SQLite) puis les renomme
+    en *.migrated pour que l'import ne soit fait qu'une fois.
+    """
+    if os.path.exists(AGENTS_FILE):
+        agents = read_json(AGENTS_FILE)
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO agents (id, token, data) VALUES (?, ?, ?)",
+                [(aid, a.get("token"), _to_db(a)) for aid, a in agents.items()],
+            )
+        os.replace(AGENTS_FILE, AGENTS_FILE + ".migrated")
+    if os.path.exists(JOBS_FILE):
+        jobs = read_json(JOBS_FILE)
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (id, agent_id, status, env_token, data) VALUES (?, ?, ?, ?, ?)",
+                [(jid, j.get("agent_id"), j.get("status"), j.get("env_token"), _to_db(j)) for jid, j in jobs.items()],
+            )
+        os.replace(JOBS_FILE, JOBS_FILE + ".migrated")
+
+def open_db(path: str) -> sqlite3.Connection:
+    """
+    Ouvre la base agents/jobs en mode WAL et crée le schéma si besoin.
+    """
+    # orch.db, orch.db-wal et orch.db-shm contiennent les tokens en clair:
+    # créés en 0600 quel que soit l'umask du process (appelé avant tout thread)
+    old_umask = os.umask(0o077)
     try:
-        with open(AGENTS_FILE, "w") as fh:
-            json.dump({}, fh)
-        os.chmod(AGENTS_FILE, 0o600)
-    except Exception:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_DB_SCHEMA)
+        # base créée par une version antérieure avec des droits plus larges
+        for p in (path, path + "-wal", path + "-shm"):
+            with suppress(FileNotFoundError):
+                os.chmod(p, 0o600)
+    except (sqlite3.Error, OSError):
         # If permission denied here, the process user likely can't write to ORCH_B_STORAGE.
-        raise RuntimeError(f"cannot create {AGENTS_FILE}; check ORCH_B_STORAGE permissions")
+        raise RuntimeError(f"cannot open {path}; check ORCH_B_STORAGE permissions")
+    finally:
+        os.umask(old_umask)
+    _import_legacy_json(conn)
+    # transactions gérées explicitement par _db_writer_loop
+    conn.isolation_level = None
+    return conn
+
+# écritures: connexion réservée au thread _db_writer_loop
+_db = open_db(DB_FILE)
+_db_local = threading.local()
+_write_queue: "queue.SimpleQueue[tuple]" = queue.SimpleQueue()
+
+def db_write(fn) -> Future:
+    """
+    Soumet `fn(conn)` au thread d'écriture et retourne un Future résolu
+    (avec la valeur de retour de `fn`, ou son exception) une fois commité.
+    """
+    fut = Future()
+    _write_queue.put((fn, fut))
+    return fut
 
-if not os.path.exists(JOBS_FILE):
-    try:
-        with open(JOBS_FILE, "w") as fh:
-            json.dump({}, fh)
-        os.chmod(JOBS_FILE, 0o600)
-    except Exception:
-        raise RuntimeError(f"cannot create {JOBS_FILE}; check ORCH_B_STORAGE permissions")
+def _db_writer_loop():
+    """
+    Thread unique d'écriture: regroupe les écritures en attente dans une
+    seule transaction (un seul commit pour tout le lot). Chaque écriture
+    a son savepoint, donc celle qui échoue est annulée sans toucher aux autres.
+    """
+    while True:
+        batch = [_write_queue.get()]
+        while True:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+        done = []
+        try:
+            _db.execute("BEGIN")
+            for fn, fut in batch:
+                _db.execute("SAVEPOINT op")
+                try:
+                    result = fn(_db)
+                except Exception as e:
+                    _db.execute("ROLLBACK TO op")
+                    _db.execute("RELEASE op")
+                    fut.set_exception(e)
+                else:
+                    _db.execute("RELEASE op")
+                    done.append((fut, result))
+            _db.execute("COMMIT")
+        except Exception as e:
+            # le thread ne doit jamais mourir: chaque appelant attend son Future
+            with suppress(sqlite3.Error):
+                if _db.in_transaction:
+                    _db.execute("ROLLBACK")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+        for fut, result in done:
+            fut.set_result(result)
+
+threading.Thread(target=_db_writer_loop, name="db-writer", daemon=True).start()
+
+def read_db() -> sqlite3.Connection:
+    """
+    Connexion de lecture propre au thread courant, sans lock.
+    En WAL chaque lecture voit un snapshot cohérent de la base: les lecteurs
+    ne bloquent pas l'écrivain et ne sont pas bloqués par lui.
+    """
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = _db_local.conn = sqlite3.connect(DB_FILE)
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+def token_digest(token: str) -> bytes:
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+# index blake2b(token) -> (agent_id, token) en mémoire; les tokens ne changent jamais une fois émis
+_token_index: Dict[bytes, Tuple[str, str]] = {
+    token_digest(token): (aid, token) for token, aid in read_db().execute("SELECT token, id FROM agents")
+}
+
+def agent_id_for_token(x_agent_token: Optional[str]) -> str:
+    """
+    Résout le header X-Agent-Token en agent_id ou lève 403.
+    Lookup par digest, puis comparaison à temps constant avec le token stocké.
+    Un miss retombe sur la base (agent enregistré par un autre worker).
+    """
+    if not x_agent_token:
+        raise HTTPException(status_code=403, detail="missing agent token")
+    digest = token_digest(x_agent_token)
+    entry = _token_index.get(digest)
+    if entry is None:
+        row = read_db().execute("SELECT id, token FROM agents WHERE token = ?", (x_agent_token,)).fetchone()
+        if not row:
+            raise HTTPException(status_code=403, detail="invalid agent token")
+        entry = _token_index[digest] = (row[0], row[1])
+    agent_id, token = entry
+    if not hmac.compare_digest(token.encode("utf-8"), x_agent_token.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="invalid agent token")
+    return agent_id
+
+# last_seen est un état "soft": on le garde en mémoire et on l'écrit au plus
+# toutes les LAST_SEEN_FLUSH_SECONDS plutôt qu'à chaque poll_jobs.
+LAST_SEEN_FLUSH_SECONDS = 5
+_pending_last_seen: Dict[str, int] = {}
+_last_seen_lock = threading.Lock()
+_last_flush_ts = time.time()
+
+def flush_last_seen() -> Optional[Future]:
+    """Soumet en une écriture les last_seen en attente, sans attendre le commit."""
+    global _pending_last_seen, _last_flush_ts
+    with _last_seen_lock:
+        pending, _pending_last_seen = _pending_last_seen, {}
+        _last_flush_ts = time.time()
+    if not pending:
+        return None
+    fut = db_write(lambda db: db.executemany(
+        "UPDATE agents SET data = json_set(data, '$.last_seen', ?) WHERE id = ?",
+        [(ts, aid) for aid, ts in pending.items()],
+    ))
+    fut.add_done_callback(lambda f: _requeue_last_seen(f, pending))
+    return fut
+
+def _requeue_last_seen(fut: Future, pending: Dict[str, int]):
+    """Si le flush a échoué, remet ses last_seen en attente pour le flush suivant."""
+    exc = fut.exception()
+    if exc is None:
+        return
+    logger.warning("last_seen flush of %d agents failed, will retry: %s", len(pending), exc)
+    with _last_seen_lock:
+        for aid, ts in pending.items():
+            if _pending_last_seen.get(aid, 0) < ts:
+                _pending_last_seen[aid] = ts
+
+def touch_last_seen(agent_id: str):
+    with _last_seen_lock:
+        _pending_last_seen[agent_id] = int(time.time())
+        due = time.time() - _last_flush_ts > LAST_SEEN_FLUSH_SECONDS
+    if due:
+        flush_last_seen()
+
+async def _last_seen_flusher():
+    while True:
+        await asyncio.sleep(LAST_SEEN_FLUSH_SECONDS)
+        flush_last_seen()
 
 
 class RegisterReq(BaseModel):
@@ -197,11 +524,10 @@ class RegisterReq(BaseModel):
 
 @app.post("/register")
 def register(req: RegisterReq):
-    agents = read_json(AGENTS_FILE)
     # create agent_id and token
     agent_id = str(uuid.uuid4())
     agent_token = uuid.uuid4().hex
-    agents[agent_id] = {
+    agent = {
         "agent_id": agent_id,
         "token": agent_token,
         "hostname": req.hostname,
@@ -211,37 +537,52 @@ def register(req: RegisterReq):
         "created": int(time.time()),
         "last_seen": int(time.time())
     }
-    write_json(AGENTS_FILE, agents)
+    db_write(lambda db: db.execute(
+        "INSERT INTO agents (id, token, data) VALUES (?, ?, ?)", (agent_id, agent_token, _to_db(agent))
+    )).result()
+    _token_index[token_digest(agent_token)] = (agent_id, agent_token)
     return {"agent_id": agent_id, "agent_token": agent_token}
 
 @app.get("/agents")
 def list_agents(x_admin_token: Optional[str] = Header(None)):
     require_admin(x_admin_token)
-    agents = read_json(AGENTS_FILE)
+    rows = read_db().execute("SELECT id, data FROM agents ORDER BY rowid").fetchall()
+    with _last_seen_lock:
+        pending = dict(_pending_last_seen)
+    agents = {}
+    for aid, data in rows:
+        agents[aid] = agent = json_loads(data)
+        if aid in pending:
+            agent["last_seen"] = pending[aid]
     return {"agents": agents}
 
+class CreateJobReq(BaseModel):
+    agent_id: str
+    is_spa: bool = False
+    args: List[str] = []
+    env_token: Optional[str] = None
+
 @app.post("/create_job")
-def create_job(payload: Dict[str, Any], x_admin_token: Optional[str] = Header(None)):
+def create_job(req: CreateJobReq, x_admin_token: Optional[str] = Header(None)):
     """
     payload expected:
       {
         "agent_id": "...",
-        "is_spa": "True or False",
+        "is_spa": true,
         "args": ["https://repo.git","domain.tld"],
         "env_token": "optional token referencing uploaded env"
       }
     """
     require_admin(x_admin_token)
-    agents = read_json(AGENTS_FILE)
-    jobs = read_json(JOBS_FILE)
-    agent_id = payload.get("agent_id")
-    if agent_id not in agents:
+    agent_id = req.agent_id
+    known = read_db().execute("SELECT 1 FROM agents WHERE id = ?", (agent_id,)).fetchone()
+    if not known:
         raise HTTPException(status_code=404, detail="agent not found")
-    args = payload.get("args", [])
-    env_token = payload.get("env_token")
-    is_spa = payload.get("is_spa", False)
+    args = req.args
+    env_token = req.env_token
+    is_spa = req.is_spa
     job_id = str(uuid.uuid4())
-    jobs[job_id] = {
+    job = {
         "job_id": job_id,
         "agent_id": agent_id,
         "args": args,
@@ -251,36 +592,26 @@ def create_job(payload: Dict[str, Any], x_admin_token: Optional[str] = Header(No
         "created": int(time.time()),
         "updated": int(time.time())
     }
-    write_json(JOBS_FILE, jobs)
+    db_write(lambda db: db.execute(
+        "INSERT INTO jobs (id, agent_id, status, env_token, data) VALUES (?, ?, ?, ?, ?)",
+        (job_id, agent_id, "pending", env_token, _to_db(job)),
+    )).result()
     return {"job_id": job_id}
 
 @app.get("/jobs")
 def list_jobs(x_admin_token: Optional[str] = Header(None)):
     require_admin(x_admin_token)
-    jobs = read_json(JOBS_FILE)
-    return {"jobs": jobs}
+    rows = read_db().execute("SELECT id, data FROM jobs ORDER BY rowid").fetchall()
+    return {"jobs": {jid: json_loads(data) for jid, data in rows}}
 
 @app.get("/poll_jobs")
 def poll_jobs(x_agent_token: Optional[str] = Header(None)):
-    if not x_agent_token:
-        raise HTTPException(status_code=403, detail="missing agent token")
-    agents = read_json(AGENTS_FILE)
-    agent_id = None
-    for aid, a in agents.items():
-        if a.get("token") == x_agent_token:
-            agent_id = aid
-            break
-    if not agent_id:
-        raise HTTPException(status_code=403, detail="invalid agent token")
-    # update last_seen
-    agents[agent_id]["last_seen"] = int(time.time())
-    write_json(AGENTS_FILE, agents)
-    jobs = read_json(JOBS_FILE)
-    pending = []
-    for jid, job in jobs.items():
-        if job.get("agent_id") == agent_id and job.get("status") == "pending":
-            pending.append(job)
-    return {"jobs": pending}
+    agent_id = agent_id_for_token(x_agent_token)
+    touch_last_seen(agent_id)
+    rows = read_db().execute(
+        "SELECT data FROM jobs WHERE agent_id = ? AND status = 'pending' ORDER BY rowid", (agent_id,)
+    ).fetchall()
+    return {"jobs": [json_loads(data) for (data,) in rows]}
 
 class ReportReq(BaseModel):
     job_id: str
@@ -289,26 +620,21 @@ class ReportReq(BaseModel):
 
 @app.post("/report")
 def report(req: ReportReq, x_agent_token: Optional[str] = Header(None)):
-    if not x_agent_token:
-        raise HTTPException(status_code=403, detail="missing agent token")
-    agents = read_json(AGENTS_FILE)
-    agent_id = None
-    for aid,a in agents.items():
-        if a.get("token") == x_agent_token:
-            agent_id = aid
-            break
-    if not agent_id:
-        raise HTTPException(status_code=403, detail="invalid agent token")
-    jobs = read_json(JOBS_FILE)
-    if req.job_id not in jobs:
-        raise HTTPException(status_code=404, detail="job not found")
-    job = jobs[req.job_id]
-    if job.get("agent_id") != agent_id:
-        raise HTTPException(status_code=403, detail="job does not belong to this agent")
-    job["status"] = req.status
-    job["output"] = req.output
-    job["updated"] = int(time.time())
-    write_json(JOBS_FILE, jobs)
+    agent_id = agent_id_for_token(x_agent_token)
+
+    def apply(db):
+        # one UPDATE in place; the job is only read back to tell 404 from 403
+        cur = db.execute(
+            "UPDATE jobs SET status = ?, data = json_set(data, '$.status', ?, '$.output', ?, '$.updated', ?)"
+            " WHERE id = ? AND agent_id = ?",
+            (req.status, req.status, req.output, int(time.time()), req.job_id, agent_id),
+        )
+        if cur.rowcount == 0:
+            if not db.execute("SELECT 1 FROM jobs WHERE id = ?", (req.job_id,)).fetchone():
+                raise HTTPException(status_code=404, detail="job not found")
+            raise HTTPException(status_code=403, detail="job does not belong to this agent")
+
+    db_write(apply).result()
     return {"ok": True}
 
 # ---- env upload / download for big env files ----
@@ -320,25 +646,20 @@ async def upload_env_file(env_file: UploadFile = File(None), env_json: Optional[
     Returns { env_token: "..." } to reference in create_job.
     """
     require_admin(x_admin_token)
+    env_token = "env_" + uuid.uuid4().hex
+    out_path = os.path.join(ORCH_B_STORAGE, "envs", f"{env_token}.json")
     if env_file:
-        contents = await env_file.read()
+        # the upload is streamed to disk as-is, then validated in place
+        tmp = await spool_upload(env_file, ENVS_DIR)
         try:
-            data = json.loads(contents.decode("utf-8"))
-        except Exception:
+            await run_in_threadpool(store_spooled_json, tmp, out_path)
+        except ValueError:
             raise HTTPException(status_code=400, detail="uploaded file not valid JSON")
     elif env_json is not None:
-        data = env_json
+        # save atomically
+        await run_in_threadpool(write_json, out_path, env_json)
     else:
         raise HTTPException(status_code=400, detail="no env provided")
-
-    env_token = "env_" + uuid.uuid4().hex
-    out_path = os.path.join(ORCH_B_STORAGE, "envs", f"{env_token}.json")
-    # save atomically
-    tmp = out_path + ".tmp"
-    with open(tmp, "w") as fh:
-        json.dump(data, fh)
-    os.replace(tmp, out_path)
-    os.chmod(out_path, 0o600)
     return {"env_token": env_token}
 
 @app.get("/download_env")
@@ -347,32 +668,23 @@ def download_env(env_token: str, x_agent_token: Optional[str] = Header(None)):
     Agent downloads env JSON referenced by env_token.
     Validation: ensure there's a pending job for this agent that references this env_token
     """
-    if not x_agent_token:
-        raise HTTPException(status_code=403, detail="missing agent token")
-    agents = read_json(AGENTS_FILE)
-    agent_id = None
-    for aid,a in agents.items():
-        if a.get("token") == x_agent_token:
-            agent_id = aid
-            break
-    if not agent_id:
-        raise HTTPException(status_code=403, detail="invalid agent token")
+    agent_id = agent_id_for_token(x_agent_token)
 
     # verify that at least one pending job for this agent references env_token
-    jobs = read_json(JOBS_FILE)
-    ok = False
-    for job in jobs.values():
-        if job.get("agent_id") == agent_id and job.get("status") == "pending" and job.get("env_token") == env_token:
-            ok = True
-            break
+    ok = read_db().execute(
+        "SELECT 1 FROM jobs WHERE agent_id = ? AND status = 'pending' AND env_token = ? LIMIT 1",
+        (agent_id, env_token),
+    ).fetchone()
     if not ok:
         raise HTTPException(status_code=403, detail="no job for this agent references this env token")
 
     path = os.path.join(ORCH_B_STORAGE, "envs", f"{env_token}.json")
-    if not os.path.exists(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="env token not found")
-    with open(path, "r") as fh:
-        data = json.load(fh)
-    return JSONResponse(content=data)
+    # le fichier est déjà du JSON valide (validé à l'upload): servi tel quel, par
+    # blocs depuis le page cache; Content-Length, Last-Modified et ETag viennent de `st`
+    return FileResponse(path, media_type="application/json", stat_result=st)
 
 # ---- end ----